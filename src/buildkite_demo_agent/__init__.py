@@ -1,36 +1,183 @@
 """Buildkite Demo Agent - OSV Vulnerability Scanner."""
 
 import asyncio
-import json
+import itertools
 import os
 import sys
-from typing import List, Optional
-import argparse
-from dotenv import load_dotenv
+from typing import Iterator, List, Optional
 
-from .osv_agent import OSVAgent, OSVConfig
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional at runtime
+    orjson = None
 
+try:
+    import ijson
+except ImportError:  # pragma: no cover - ijson is optional at runtime
+    ijson = None
 
-def parse_packages_from_file(file_path: str) -> List[dict]:
+# Choices accepted by the CLI, in the order shown in --help
+SEVERITY_LEVELS = ('low', 'medium', 'high', 'critical')
+OUTPUT_FORMATS = ('json', 'text')
+
+# Keys of a package dictionary, in package:ecosystem:version order
+_PKG_KEYS = ('package_name', 'ecosystem', 'version')
+
+# Result keys checked for each severity threshold, from the threshold upwards
+_THRESHOLD_KEYS = {
+    'low': ('low_vulnerabilities', 'medium_vulnerabilities', 'high_vulnerabilities', 'critical_vulnerabilities'),
+    'medium': ('medium_vulnerabilities', 'high_vulnerabilities', 'critical_vulnerabilities'),
+    'high': ('high_vulnerabilities', 'critical_vulnerabilities'),
+    'critical': ('critical_vulnerabilities',),
+}
+
+# Severity lists shown in text output, with their labels
+_SEVERITY_LABELS = (
+    ('critical_vulnerabilities', '🚨 Critical'),
+    ('high_vulnerabilities', '⚠️  High'),
+    ('medium_vulnerabilities', '⚡ Medium'),
+    ('low_vulnerabilities', '🔹 Low'),
+)
+
+# Batches larger than this are serialized in a worker thread
+OFFLOAD_THRESHOLD = 100
+
+# Examples shown at the end of --help
+_EPILOG = """
+Examples:
+  # Scan single package
+  buildkite-demo-agent --package requests --ecosystem PyPI --version 2.25.0
+  
+  # Scan multiple packages from command line
+  buildkite-demo-agent --packages "requests:PyPI:2.25.0,lodash:npm:4.17.20"
+  
+  # Scan packages from file
+  buildkite-demo-agent --packages-file packages.json
+  
+  # Get vulnerability details
+  buildkite-demo-agent --vulnerability-id GHSA-9hjg-9r4m-mvj7
+  
+  # Use custom OSV server
+  buildkite-demo-agent --osv-server http://localhost:3000 --package requests --ecosystem PyPI --version 2.25.0
+  
+  # Query the OSV API directly, without Claude or MCP
+  buildkite-demo-agent --direct --packages-file packages.json
+        """
+
+# Pre-rendered --help output, so cli() can answer without building the
+# argument parser. Keep in sync with the arguments defined in main().
+HELP_TEXT = """\
+usage: buildkite-demo-agent [-h] [--package PACKAGE] [--ecosystem ECOSYSTEM]
+                            [--version VERSION] [--packages PACKAGES]
+                            [--packages-file PACKAGES_FILE]
+                            [--vulnerability-id VULNERABILITY_ID]
+                            [--osv-server OSV_SERVER]
+                            [--anthropic-api-key ANTHROPIC_API_KEY] [--direct]
+                            [--max-concurrency MAX_CONCURRENCY]
+                            [--output-format {json,text}]
+                            [--output-file OUTPUT_FILE]
+                            [--fail-on-vulnerabilities]
+                            [--severity-threshold {low,medium,high,critical}]
+
+OSV Vulnerability Scanner for Buildkite pipelines
+
+options:
+  -h, --help            show this help message and exit
+  --package PACKAGE     Package name to scan
+  --ecosystem ECOSYSTEM
+                        Package ecosystem (PyPI, npm, Go, etc.)
+  --version VERSION     Package version to scan
+  --packages PACKAGES   Comma-separated packages in format:
+                        package:ecosystem:version
+  --packages-file PACKAGES_FILE
+                        JSON file containing packages to scan
+  --vulnerability-id VULNERABILITY_ID
+                        Get details for specific vulnerability ID
+  --osv-server OSV_SERVER
+                        OSV MCP server URL (default: http://localhost:8080)
+  --anthropic-api-key ANTHROPIC_API_KEY
+                        Anthropic API key (can also use ANTHROPIC_API_KEY env
+                        var)
+  --direct              Query the OSV API directly instead of using Claude and
+                        MCP (default when no Anthropic API key is set)
+  --max-concurrency MAX_CONCURRENCY
+                        Maximum number of packages scanned concurrently
+                        (default: 8)
+  --output-format {json,text}
+                        Output format (default: text)
+  --output-file OUTPUT_FILE
+                        Write output to file instead of stdout
+  --fail-on-vulnerabilities
+                        Exit with code 1 if vulnerabilities are found (useful
+                        for CI/CD)
+  --severity-threshold {low,medium,high,critical}
+                        Minimum severity to report (default: medium)
+
+""" + _EPILOG.strip('\n') + '\n'
+
+
+def __getattr__(name: str):
+    """Lazily expose the agent classes so importing the CLI stays cheap."""
+    if name in ('OSVAgent', 'OSVConfig'):
+        from . import osv_agent
+        return getattr(osv_agent, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def loads_json(data: bytes):
+    """Decode JSON, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    import json
+    return json.loads(data)
+
+
+def dumps_json(obj) -> str:
+    """Encode JSON with two-space indentation, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    import json
+    return json.dumps(obj, indent=2)
+
+
+def write_output_file(file_path: str, content: str) -> None:
+    """Write formatted output to a file."""
+    with open(file_path, 'w') as f:
+        f.write(content)
+
+
+def parse_packages_from_file(file_path: str) -> Iterator[dict]:
     """Parse packages from a JSON file.
     
+    Packages are yielded one at a time as the file is read, so large package
+    lists are never fully materialized before validation.
+    
     Expected format:
     [
         {"package_name": "requests", "ecosystem": "PyPI", "version": "2.25.0"},
         {"package_name": "lodash", "ecosystem": "npm", "version": "4.17.20"}
     ]
     """
+    required_keys = ['package_name', 'ecosystem', 'version']
     try:
-        with open(file_path, 'r') as f:
-            packages = json.load(f)
-        
-        # Validate package format
-        for pkg in packages:
-            required_keys = ['package_name', 'ecosystem', 'version']
-            if not all(key in pkg for key in required_keys):
-                raise ValueError(f"Package missing required keys: {required_keys}")
-        
-        return packages
+        with open(file_path, 'rb') as f:
+            if ijson is not None:
+                # use_float keeps numbers as floats, as json.load does, not Decimal
+                events = ijson.parse(f, use_float=True)
+                first = next(events, None)
+                if first is None or first[1] != 'start_array':
+                    raise ValueError("Packages file must contain a JSON array")
+                packages = ijson.items(itertools.chain([first], events), 'item')
+            else:
+                packages = loads_json(f.read())
+                if not isinstance(packages, list):
+                    raise ValueError("Packages file must contain a JSON array")
+            
+            for pkg in packages:
+                # Validate package format
+                if not all(key in pkg for key in required_keys):
+                    raise ValueError(f"Package missing required keys: {required_keys}")
+                yield pkg
     except Exception as e:
         print(f"Error parsing packages file: {e}", file=sys.stderr)
         sys.exit(1)
@@ -42,49 +189,39 @@ def parse_packages_from_args(packages_str: str) -> List[dict]:
     Format: "package1:ecosystem1:version1,package2:ecosystem2:version2"
     Example: "requests:PyPI:2.25.0,lodash:npm:4.17.20"
     """
-    packages = []
     try:
-        for pkg_str in packages_str.split(','):
-            parts = pkg_str.strip().split(':')
+        parts_list = [pkg_str.strip().split(':', 2) for pkg_str in packages_str.split(',')]
+        for parts in parts_list:
             if len(parts) != 3:
-                raise ValueError(f"Invalid package format: {pkg_str}. Expected format: package:ecosystem:version")
-            
-            packages.append({
-                'package_name': parts[0],
-                'ecosystem': parts[1],
-                'version': parts[2]
-            })
-        return packages
+                raise ValueError(f"Invalid package format: {':'.join(parts)}. Expected format: package:ecosystem:version")
+        return [dict(zip(_PKG_KEYS, parts)) for parts in parts_list]
     except Exception as e:
         print(f"Error parsing packages: {e}", file=sys.stderr)
         sys.exit(1)
 
 
+def positive_int(value: str) -> int:
+    """Argparse type for options that must be a whole number of at least 1."""
+    import argparse
+    
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 async def main():
     """Main CLI entry point."""
-    # Load environment variables
-    load_dotenv()
+    import argparse
     
     parser = argparse.ArgumentParser(
+        prog='buildkite-demo-agent',
         description="OSV Vulnerability Scanner for Buildkite pipelines",
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
-Examples:
-  # Scan single package
-  buildkite-demo-agent --package requests --ecosystem PyPI --version 2.25.0
-  
-  # Scan multiple packages from command line
-  buildkite-demo-agent --packages "requests:PyPI:2.25.0,lodash:npm:4.17.20"
-  
-  # Scan packages from file
-  buildkite-demo-agent --packages-file packages.json
-  
-  # Get vulnerability details
-  buildkite-demo-agent --vulnerability-id GHSA-9hjg-9r4m-mvj7
-  
-  # Use custom OSV server
-  buildkite-demo-agent --osv-server http://localhost:3000 --package requests --ecosystem PyPI --version 2.25.0
-        """
+        epilog=_EPILOG
     )
     
     # Single package scanning
@@ -103,16 +240,21 @@ Examples:
     parser.add_argument('--osv-server', default='http://localhost:8080', 
                        help='OSV MCP server URL (default: http://localhost:8080)')
     parser.add_argument('--anthropic-api-key', help='Anthropic API key (can also use ANTHROPIC_API_KEY env var)')
+    parser.add_argument('--direct', action='store_true',
+                       help='Query the OSV API directly instead of using Claude and MCP '
+                            '(default when no Anthropic API key is set)')
+    parser.add_argument('--max-concurrency', type=positive_int, default=8,
+                       help='Maximum number of packages scanned concurrently (default: 8)')
     
     # Output options
-    parser.add_argument('--output-format', choices=['json', 'text'], default='text',
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='text',
                        help='Output format (default: text)')
     parser.add_argument('--output-file', help='Write output to file instead of stdout')
     
     # Buildkite specific
     parser.add_argument('--fail-on-vulnerabilities', action='store_true',
                        help='Exit with code 1 if vulnerabilities are found (useful for CI/CD)')
-    parser.add_argument('--severity-threshold', choices=['low', 'medium', 'high', 'critical'], 
+    parser.add_argument('--severity-threshold', choices=SEVERITY_LEVELS, 
                        default='medium', help='Minimum severity to report (default: medium)')
     
     args = parser.parse_args()
@@ -130,46 +272,74 @@ Examples:
               file=sys.stderr)
         sys.exit(1)
     
+    # Parse --packages before connecting so a malformed list fails fast;
+    # a packages file is still read lazily as it is scanned
+    packages = parse_packages_from_args(args.packages) if args.packages else None
+    
+    # Heavy imports are deferred until the arguments are known to be valid
+    from dotenv import load_dotenv
+    from .osv_agent import OSVAgent, OSVConfig
+    
+    # Load environment variables
+    load_dotenv()
+    
+    # Package scans don't need the LLM, so go direct to OSV when asked or
+    # when there is no API key; vulnerability explanations always use Claude
+    has_api_key = bool(args.anthropic_api_key or os.getenv('ANTHROPIC_API_KEY'))
+    direct = not args.vulnerability_id and (args.direct or not has_api_key)
+    
     # Create configuration
     config = OSVConfig(
         osv_server_url=args.osv_server,
-        anthropic_api_key=args.anthropic_api_key
+        anthropic_api_key=args.anthropic_api_key,
+        max_concurrency=args.max_concurrency,
+        direct=direct
     )
     
     try:
-        # Initialize agent
-        agent = OSVAgent(config)
-        
-        # Determine what to scan
-        if args.vulnerability_id:
-            # Get vulnerability details
-            result = await agent.get_vulnerability_details(args.vulnerability_id)
-            output = {"vulnerability_id": args.vulnerability_id, "details": result}
-            
-        elif args.package:
-            # Single package scan
-            result = await agent.scan_package(args.package, args.ecosystem, args.version)
-            output = result.model_dump()
+        # Initialize agent and open the MCP session shared by all scans
+        async with OSVAgent(config) as agent:
+            # Determine what to scan
+            if args.vulnerability_id:
+                # Get vulnerability details
+                result = await agent.get_vulnerability_details(args.vulnerability_id)
+                output = {"vulnerability_id": args.vulnerability_id, "details": result}
             
-        elif args.packages:
-            # Multiple packages from command line
-            packages = parse_packages_from_args(args.packages)
-            results = await agent.scan_packages_batch(packages)
-            output = [result.model_dump() for result in results]
+            elif args.package:
+                # Single package scan
+                if config.direct:
+                    package = dict(zip(_PKG_KEYS, (args.package, args.ecosystem, args.version)))
+                    output = (await agent.scan_packages_direct([package]))[0]
+                else:
+                    result = await agent.scan_package(args.package, args.ecosystem, args.version)
+                    output = result.model_dump()
             
-        elif args.packages_file:
-            # Multiple packages from file
-            packages = parse_packages_from_file(args.packages_file)
-            results = await agent.scan_packages_batch(packages)
-            output = [result.model_dump() for result in results]
+            else:
+                if packages is None:
+                    # Multiple packages from file
+                    packages = parse_packages_from_file(args.packages_file)
+                if config.direct:
+                    # Direct scans already produce plain dicts, so skip pydantic entirely
+                    output = await agent.scan_packages_direct(packages)
+                else:
+                    results = await agent.scan_packages_batch_single(packages)
+                    # Dump once; the formatters and threshold check all reuse these dicts
+                    output = [result.model_dump() for result in results]
         
-        # Format output
+        # Format output, moving large batches off the event loop
+        offload = isinstance(output, list) and len(output) > OFFLOAD_THRESHOLD
         if args.output_format == 'json':
-            output_str = json.dumps(output, indent=2)
+            if offload:
+                output_str = await asyncio.to_thread(dumps_json, output)
+            else:
+                output_str = dumps_json(output)
         else:
             # Text format
             if isinstance(output, list):
-                output_str = format_batch_results(output, args.severity_threshold)
+                if offload:
+                    output_str = await asyncio.to_thread(format_batch_results, output, args.severity_threshold)
+                else:
+                    output_str = format_batch_results(output, args.severity_threshold)
             elif 'vulnerability_id' in output:
                 output_str = f"Vulnerability {output['vulnerability_id']}:\n{output['details']}"
             else:
@@ -177,67 +347,71 @@ Examples:
         
         # Write output
         if args.output_file:
-            with open(args.output_file, 'w') as f:
-                f.write(output_str)
+            await asyncio.to_thread(write_output_file, args.output_file, output_str)
             print(f"Results written to {args.output_file}")
         else:
             print(output_str)
         
         # Check if we should fail on vulnerabilities
-        if args.fail_on_vulnerabilities and has_vulnerabilities_above_threshold(output, args.severity_threshold):
-            print(f"\n❌ Vulnerabilities found above {args.severity_threshold} severity threshold", file=sys.stderr)
-            sys.exit(1)
+        if args.fail_on_vulnerabilities:
+            # A package that could not be scanned must never count as clean
+            failed = count_failed_scans(output)
+            if failed:
+                print(f"\n❌ {failed} package(s) could not be scanned", file=sys.stderr)
+                sys.exit(1)
+            if has_vulnerabilities_above_threshold(output, args.severity_threshold):
+                print(f"\n❌ Vulnerabilities found above {args.severity_threshold} severity threshold", file=sys.stderr)
+                sys.exit(1)
         
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
 
+def count_failed_scans(output) -> int:
+    """Count the scan results for packages that could not be scanned."""
+    if isinstance(output, list):
+        return sum(1 for result in output if result.get('scan_failed'))
+    return int(bool(output.get('scan_failed')))
+
+
 def has_vulnerabilities_above_threshold(output, threshold: str) -> bool:
     """Check if vulnerabilities exist above the specified threshold."""
-    severity_levels = ['low', 'medium', 'high', 'critical']
-    threshold_index = severity_levels.index(threshold)
-    
     if isinstance(output, list):
-        for result in output:
-            if check_single_result_threshold(result, threshold_index, severity_levels):
-                return True
-    else:
-        return check_single_result_threshold(output, threshold_index, severity_levels)
-    
-    return False
+        return any(check_single_result_threshold(result, threshold) for result in output)
+    return check_single_result_threshold(output, threshold)
 
 
-def check_single_result_threshold(result: dict, threshold_index: int, severity_levels: List[str]) -> bool:
+def check_single_result_threshold(result: dict, threshold: str) -> bool:
     """Check if a single result has vulnerabilities above threshold."""
-    for i in range(threshold_index, len(severity_levels)):
-        severity = severity_levels[i]
-        key = f"{severity}_vulnerabilities"
-        if key in result and result[key]:
-            return True
-    return False
+    return any(result.get(key) for key in _THRESHOLD_KEYS[threshold])
 
 
-def format_single_result(result: dict, threshold: str) -> str:
-    """Format a single scan result for text output."""
-    lines = []
-    lines.append(f"📦 Package: {result['package_name']} ({result['ecosystem']}) v{result['version']}")
-    lines.append(f"🔍 Vulnerabilities found: {result['vulnerabilities_found']}")
+def append_result_lines(lines: List[str], result: dict, prefix: str = "") -> None:
+    """Append the text output lines for a single scan result to ``lines``."""
+    get = result.get
+    found = get('vulnerabilities_found', 0)
+    lines.append(f"{prefix}📦 Package: {get('package_name')} ({get('ecosystem')}) v{get('version')}")
+    lines.append(f"🔍 Vulnerabilities found: {found}")
     
-    if result['vulnerabilities_found'] > 0:
-        if result['critical_vulnerabilities']:
-            lines.append(f"🚨 Critical: {', '.join(result['critical_vulnerabilities'])}")
-        if result['high_vulnerabilities']:
-            lines.append(f"⚠️  High: {', '.join(result['high_vulnerabilities'])}")
-        if result['medium_vulnerabilities']:
-            lines.append(f"⚡ Medium: {', '.join(result['medium_vulnerabilities'])}")
+    if found > 0:
+        for key, label in _SEVERITY_LABELS:
+            vulns = get(key)
+            if vulns:
+                lines.append(f"{label}: {', '.join(vulns)}")
         
-        if result['recommendations']:
+        recommendations = get('recommendations')
+        if recommendations:
             lines.append("\n💡 Recommendations:")
-            for rec in result['recommendations']:
-                lines.append(f"  • {rec}")
+            lines.extend(f"  • {rec}" for rec in recommendations)
     
-    lines.append(f"\n📋 Summary: {result['summary']}")
+    lines.append(f"\n📋 Summary: {get('summary')}")
+
+
+def format_single_result(result: dict, threshold: str) -> str:
+    """Format a single scan result for text output."""
+    lines = []
+    append_result_lines(lines, result)
     return '\n'.join(lines)
 
 
@@ -251,11 +425,15 @@ def format_batch_results(results: List[dict], threshold: str) -> str:
     vulnerable_packages = sum(1 for r in results if r['vulnerabilities_found'] > 0)
     
     lines.append(f"📊 Summary: {vulnerable_packages}/{total_packages} packages have vulnerabilities")
+    failed_packages = count_failed_scans(results)
+    if failed_packages:
+        lines.append(f"❗ {failed_packages}/{total_packages} packages could not be scanned")
     lines.append("")
     
+    # Every result appends to the same list so the output is joined only once
     for i, result in enumerate(results, 1):
-        lines.append(f"{i}. {format_single_result(result, threshold)}")
-        if i < len(results):
+        append_result_lines(lines, result, prefix=f"{i}. ")
+        if i < total_packages:
             lines.append("-" * 30)
     
     return '\n'.join(lines)
@@ -263,6 +441,11 @@ def format_batch_results(results: List[dict], threshold: str) -> str:
 
 def cli():
     """CLI entry point for the buildkite-demo-agent command."""
+    # Answer --help from the pre-rendered text without importing argparse
+    argv = sys.argv[1:]
+    if '-h' in argv or '--help' in argv:
+        sys.stdout.write(HELP_TEXT)
+        sys.exit(0)
     asyncio.run(main())
 
 
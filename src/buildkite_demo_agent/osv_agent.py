@@ -1,12 +1,21 @@
 """OSV Vulnerability Scanner Agent using pydantic.ai and MCP."""
 
+import asyncio
+import json
 import os
+import re
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import httpx
+from anthropic import APIConnectionError
+from pydantic import BaseModel, Field
+from pydantic.json_schema import SkipJsonSchema
 from pydantic_ai import Agent
 from pydantic_ai.models.anthropic import AnthropicModel
 from pydantic_ai.mcp import MCPServerSSE, MCPServerStreamableHTTP
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 
 class VulnerabilityInfo(BaseModel):
@@ -18,19 +27,309 @@ class VulnerabilityInfo(BaseModel):
     critical_vulnerabilities: List[str]
     high_vulnerabilities: List[str]
     medium_vulnerabilities: List[str]
+    low_vulnerabilities: List[str] = Field(default_factory=list)
     recommendations: List[str]
     summary: str
+    # Set by the scanner, never by the model, when a package could not be scanned
+    scan_failed: SkipJsonSchema[bool] = False
 
 
-@dataclass
+class BatchResult(BaseModel):
+    """Structured output for a batch of vulnerability scans."""
+    results: List[VulnerabilityInfo]
+
+
+# URL suffixes mapped to the MCP transport that serves them
+_TRANSPORTS = (
+    ('/sse', MCPServerSSE),
+    # Streamable HTTP endpoints are always addressed with a trailing slash
+    ('/mcp', lambda url: MCPServerStreamableHTTP(f"{url.rstrip('/')}/")),
+    ('/mcp/', lambda url: MCPServerStreamableHTTP(f"{url.rstrip('/')}/")),
+)
+
+_MODEL: Optional[AnthropicModel] = None
+
+# Transient network failures are retried with jittered exponential backoff.
+# pydantic_ai passes Anthropic connection errors and timeouts through unwrapped
+# (APITimeoutError subclasses APIConnectionError); OSV calls raise httpx errors.
+_TRANSIENT_ERRORS = (httpx.TimeoutException, httpx.NetworkError, ConnectionError, APIConnectionError)
+
+_retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=0.5, max=5),
+    retry=retry_if_exception_type(_TRANSIENT_ERRORS),
+    reraise=True,
+)
+
+# Maximum number of queries OSV accepts in one querybatch request
+_QUERYBATCH_LIMIT = 1000
+
+# Packages per agent run, keeping each prompt and structured reply well
+# inside the model's context and output limits
+_LLM_BATCH_SIZE = 25
+
+# OSV advisory severities mapped to the result severity buckets
+_SEVERITY_BUCKETS = {
+    'CRITICAL': 'critical',
+    'HIGH': 'high',
+    'MODERATE': 'medium',
+    'MEDIUM': 'medium',
+    'LOW': 'low',
+}
+
+# CVSS v3.x base metric weights, keyed by metric then value
+_CVSS3_WEIGHTS = {
+    'AV': {'N': 0.85, 'A': 0.62, 'L': 0.55, 'P': 0.2},
+    'AC': {'L': 0.77, 'H': 0.44},
+    'UI': {'N': 0.85, 'R': 0.62},
+    'C': {'H': 0.56, 'L': 0.22, 'N': 0.0},
+    'I': {'H': 0.56, 'L': 0.22, 'N': 0.0},
+    'A': {'H': 0.56, 'L': 0.22, 'N': 0.0},
+}
+# Privileges Required weights depend on whether the scope changes
+_CVSS3_PR_WEIGHTS = {
+    'U': {'N': 0.85, 'L': 0.62, 'H': 0.27},
+    'C': {'N': 0.85, 'L': 0.68, 'H': 0.5},
+}
+
+
+def _get_model() -> AnthropicModel:
+    """Return the Anthropic model shared by all agents."""
+    global _MODEL
+    _MODEL = _MODEL or AnthropicModel('claude-3-5-sonnet-20241022')
+    return _MODEL
+
+
+def _create_mcp_server(url: str):
+    """Create an MCP server connection, picking the transport from the URL."""
+    for suffix, transport in _TRANSPORTS:
+        if url.endswith(suffix):
+            return transport(url)
+    # Default to SSE transport with /sse path
+    return MCPServerSSE(f"{url}/sse")
+
+
+def _cvss3_roundup(value: float) -> float:
+    """Round up to one decimal as specified by CVSS v3.1."""
+    scaled = round(value * 100000)
+    if scaled % 10000 == 0:
+        return scaled / 100000.0
+    return (scaled // 10000 + 1) / 10.0
+
+
+def _cvss3_base_score(vector: str) -> Optional[float]:
+    """Compute the base score of a CVSS v3.x vector, or None if it is malformed."""
+    try:
+        metrics = dict(part.split(':', 1) for part in vector.split('/')[1:])
+        scope = metrics['S']
+        weights = {name: table[metrics[name]] for name, table in _CVSS3_WEIGHTS.items()}
+        privileges = _CVSS3_PR_WEIGHTS[scope][metrics['PR']]
+    except (KeyError, ValueError):
+        return None
+
+    iss = 1 - (1 - weights['C']) * (1 - weights['I']) * (1 - weights['A'])
+    if scope == 'U':
+        impact = 6.42 * iss
+    else:
+        impact = 7.52 * (iss - 0.029) - 3.25 * (iss - 0.02) ** 15
+    if impact <= 0:
+        return 0.0
+    exploitability = 8.22 * weights['AV'] * weights['AC'] * privileges * weights['UI']
+    if scope == 'U':
+        return _cvss3_roundup(min(impact + exploitability, 10))
+    return _cvss3_roundup(min(1.08 * (impact + exploitability), 10))
+
+
+def _severity_bucket(vuln: dict) -> Optional[str]:
+    """Return the severity bucket of an OSV record, or None if it is unrated."""
+    severity = (vuln.get('database_specific') or {}).get('severity', '')
+    bucket = _SEVERITY_BUCKETS.get(str(severity).upper())
+    if bucket:
+        return bucket
+
+    scores = [
+        score
+        for entry in vuln.get('severity', [])
+        if entry.get('type') == 'CVSS_V3'
+        for score in [_cvss3_base_score(entry.get('score', ''))]
+        if score is not None
+    ]
+    if not scores:
+        return None
+    score = max(scores)
+    if score >= 9.0:
+        return 'critical'
+    if score >= 7.0:
+        return 'high'
+    if score >= 4.0:
+        return 'medium'
+    return 'low'
+
+
+def _group_aliases(vulns: List[dict]) -> List[List[dict]]:
+    """Group OSV records that describe the same vulnerability.
+
+    Databases republish each other's advisories (a GHSA record and a PYSEC
+    record for the same CVE, say), linking them through ``aliases``. Records
+    sharing an ID or alias end up in one group, in first-seen order.
+    """
+    parent = list(range(len(vulns)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner: Dict[str, int] = {}
+    for i, vuln in enumerate(vulns):
+        for name in [vuln['id'], *vuln.get('aliases', [])]:
+            if name in owner:
+                parent[find(i)] = find(owner[name])
+            else:
+                owner[name] = i
+
+    groups: Dict[int, List[dict]] = {}
+    for i, vuln in enumerate(vulns):
+        groups.setdefault(find(i), []).append(vuln)
+    return list(groups.values())
+
+
+def _normalize_name(name: str, ecosystem: str) -> str:
+    """Normalize a package name for comparison within its ecosystem."""
+    if ecosystem.casefold() == 'pypi':
+        # PEP 503: runs of '-', '_' and '.' are equivalent and case is ignored
+        return re.sub(r'[-_.]+', '-', name).casefold()
+    return name.casefold()
+
+
+def _version_key(version: str) -> tuple:
+    """Build a best-effort sort key for a release version.
+
+    Numeric parts compare numerically; alphabetic parts (pre-release tags)
+    sort below the release they precede, so 1.0rc1 < 1.0 < 1.0.1.
+    """
+    version = version[1:] if re.match(r'v\d', version) else version
+    parts = [(1, int(token)) if token.isdigit() else (0, token.casefold())
+             for token in re.findall(r'\d+|[A-Za-z]+', version)]
+    return (*parts, (0.5, ''))
+
+
+def _applicable_fixes(affected: dict, version: str) -> List[str]:
+    """Return the fixed versions of the ranges that contain the scanned version."""
+    current = _version_key(version)
+    fixes = []
+    for range_ in affected.get('ranges', []):
+        # GIT ranges are commit hashes, not versions a user can upgrade to
+        if range_.get('type') not in ('SEMVER', 'ECOSYSTEM'):
+            continue
+        introduced = None
+        for event in range_.get('events', []):
+            if 'introduced' in event:
+                introduced = event['introduced']
+            elif 'fixed' in event and introduced is not None:
+                lower = introduced == '0' or _version_key(introduced) <= current
+                if lower and current < _version_key(event['fixed']):
+                    fixes.append(event['fixed'])
+                introduced = None
+            elif 'last_affected' in event or 'limit' in event:
+                introduced = None
+    return fixes
+
+
+def _build_result_dict(package_name: str, ecosystem: str, version: str, vulns: List[dict]) -> dict:
+    """Build a scan result shaped like VulnerabilityInfo from raw OSV records."""
+    buckets: Dict[str, List[str]] = {'critical': [], 'high': [], 'medium': [], 'low': []}
+    recommendations = []
+    name = _normalize_name(package_name, ecosystem)
+    groups = _group_aliases(vulns)
+    for group in groups:
+        rated = [(vuln, _severity_bucket(vuln)) for vuln in group]
+        # Report each vulnerability once, preferring a rated GitHub advisory
+        vuln, bucket = min(
+            rated, key=lambda item: (item[1] is None, not item[0]['id'].startswith('GHSA-'))
+        )
+        vuln_id = vuln['id']
+        # Unrated advisories are reported as medium so they are never dropped
+        buckets[bucket or 'medium'].append(vuln_id)
+
+        fixed = sorted({
+            fix
+            for record in group
+            for affected in record.get('affected', [])
+            if _normalize_name(affected.get('package', {}).get('name', ''), ecosystem) == name
+            for fix in _applicable_fixes(affected, version)
+        }, key=_version_key)
+        if fixed:
+            recommendations.append(f"{vuln_id}: upgrade to {', '.join(fixed)}")
+
+    if groups:
+        noun = "vulnerability affects" if len(groups) == 1 else "vulnerabilities affect"
+        summary = f"{len(groups)} known {noun} {package_name}@{version}"
+    else:
+        summary = f"No known vulnerabilities affect {package_name}@{version}"
+
+    return {
+        'package_name': package_name,
+        'ecosystem': ecosystem,
+        'version': version,
+        'vulnerabilities_found': len(groups),
+        'critical_vulnerabilities': buckets['critical'],
+        'high_vulnerabilities': buckets['high'],
+        'medium_vulnerabilities': buckets['medium'],
+        'low_vulnerabilities': buckets['low'],
+        'recommendations': recommendations,
+        'summary': summary,
+        'scan_failed': False,
+    }
+
+
+def _error_dict(package_name: str, ecosystem: str, version: str, error: Exception) -> dict:
+    """Build a placeholder result for a package that could not be scanned."""
+    return {
+        'package_name': package_name,
+        'ecosystem': ecosystem,
+        'version': version,
+        'vulnerabilities_found': 0,
+        'critical_vulnerabilities': [],
+        'high_vulnerabilities': [],
+        'medium_vulnerabilities': [],
+        'low_vulnerabilities': [],
+        'recommendations': [f"Error scanning package: {str(error)}"],
+        'summary': f"Failed to scan {package_name}@{version}: {str(error)}",
+        'scan_failed': True,
+    }
+
+
+@dataclass(slots=True, frozen=True)
 class OSVConfig:
     """Configuration for OSV agent."""
     osv_server_url: str = "http://localhost:8080"
     anthropic_api_key: Optional[str] = None
+    max_concurrency: int = 8
+    cache_size: int = 1024
+    # Query the OSV HTTP API directly instead of going through the LLM and MCP
+    direct: bool = False
+    osv_api_url: str = "https://api.osv.dev/v1"
+    # Stop scanning for circuit_reset_seconds after this many consecutive failures
+    failure_threshold: int = 10
+    circuit_reset_seconds: float = 30.0
+
+    def __post_init__(self):
+        if self.max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {self.max_concurrency}")
 
 
 class OSVAgent:
-    """Agent for querying OSV vulnerability database via MCP."""
+    """Agent for querying OSV vulnerability database via MCP.
+
+    The MCP session is shared by every scan and must be opened by using the
+    agent as an async context manager. In direct mode scans go straight to
+    the OSV HTTP API and no LLM or MCP server is used::
+
+        async with OSVAgent(config) as agent:
+            result = await agent.scan_package('requests', 'PyPI', '2.25.0')
+    """
 
     def __init__(self, config: OSVConfig):
         """Initialize the OSV agent.
@@ -39,6 +338,21 @@ class OSVAgent:
             config: Configuration for the OSV agent
         """
         self.config = config
+        self._mcp_session = None
+        # HTTP client shared by all direct OSV API calls, opened on first use
+        self._http: Optional[httpx.AsyncClient] = None
+        # Circuit breaker state shared by all scans
+        self._consecutive_failures = 0
+        self._circuit_open_until = 0.0
+        # Bounded LRU of scan results keyed by (package_name, ecosystem, version).
+        # Holds VulnerabilityInfo for agent scans and plain dicts for direct scans.
+        self._cache: "OrderedDict[Tuple[str, str, str], Union[VulnerabilityInfo, dict]]" = OrderedDict()
+        
+        if config.direct:
+            # Direct scans need neither the LLM nor an MCP server
+            self.osv_server = None
+            self.agent = None
+            return
         
         # Set up Anthropic API key
         api_key = config.anthropic_api_key or os.getenv('ANTHROPIC_API_KEY')
@@ -46,22 +360,11 @@ class OSVAgent:
             raise ValueError("ANTHROPIC_API_KEY must be provided via config or environment variable")
         
         # Create MCP server connection for OSV - auto-detect transport from URL
-        if config.osv_server_url.endswith('/sse'):
-            self.osv_server = MCPServerSSE(config.osv_server_url)
-        elif config.osv_server_url.endswith('/mcp') or config.osv_server_url.endswith('/mcp/'):
-            # Remove trailing slash if present
-            url = config.osv_server_url.rstrip('/')
-            self.osv_server = MCPServerStreamableHTTP(f"{url}/")
-        else:
-            # Default to SSE transport with /sse path
-            self.osv_server = MCPServerSSE(f"{config.osv_server_url}/sse")
-        
-        # Create the model
-        model = AnthropicModel('claude-3-5-sonnet-20241022')
+        self.osv_server = _create_mcp_server(config.osv_server_url)
         
         # Create the agent with OSV MCP tools
         self.agent = Agent(
-            model=model,
+            model=_get_model(),
             mcp_servers=[self.osv_server],
             output_type=VulnerabilityInfo,
             system_prompt="""
@@ -87,6 +390,22 @@ For severity classification:
 Always provide the package name, ecosystem, version, vulnerability count, categorized vulnerabilities, recommendations, and a clear summary.
 """)
 
+    async def __aenter__(self) -> "OSVAgent":
+        """Open the MCP server session shared by all scans."""
+        if self.agent is not None:
+            self._mcp_session = self.agent.run_mcp_servers()
+            await self._mcp_session.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        """Close the MCP server session and HTTP client."""
+        session, self._mcp_session = self._mcp_session, None
+        if session is not None:
+            await session.__aexit__(exc_type, exc, tb)
+        http, self._http = self._http, None
+        if http is not None:
+            await http.aclose()
+
     async def scan_package(self, package_name: str, ecosystem: str, version: str) -> VulnerabilityInfo:
         """Scan a single package for vulnerabilities.
         
@@ -98,44 +417,119 @@ Always provide the package name, ecosystem, version, vulnerability count, catego
         Returns:
             VulnerabilityInfo with scan results
         """
+        if self.config.direct:
+            return await self.scan_package_direct(package_name, ecosystem, version)
+
+        key = (package_name, ecosystem, version)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        if self._circuit_open():
+            return self._error_result(package_name, ecosystem, version, self._circuit_error())
+
         query = f"Scan {package_name} version {version} from {ecosystem} ecosystem for vulnerabilities"
         
         try:
-            async with self.agent.run_mcp_servers():
-                result = await self.agent.run(query)
-                return result.output
+            result = await self._run_agent(query)
         except Exception as e:
             # Return a basic error response if MCP fails
-            return VulnerabilityInfo(
-                package_name=package_name,
-                ecosystem=ecosystem,
-                version=version,
-                vulnerabilities_found=0,
-                critical_vulnerabilities=[],
-                high_vulnerabilities=[],
-                medium_vulnerabilities=[],
-                recommendations=[f"Error scanning package: {str(e)}"],
-                summary=f"Failed to scan {package_name}@{version}: {str(e)}"
-            )
+            self._record_failure()
+            return self._error_result(package_name, ecosystem, version, e)
+        self._record_success()
+        self._cache_put(key, result.output)
+        return result.output
 
-    async def scan_packages_batch(self, packages: List[dict]) -> List[VulnerabilityInfo]:
+    async def scan_package_direct(self, package_name: str, ecosystem: str, version: str) -> VulnerabilityInfo:
+        """Scan a single package by querying the OSV HTTP API directly.
+        
+        Args:
+            package_name: Name of the package to scan
+            ecosystem: Package ecosystem (e.g., PyPI, npm, Go)
+            version: Package version to scan
+            
+        Returns:
+            VulnerabilityInfo with scan results
+        """
+        package = {'package_name': package_name, 'ecosystem': ecosystem, 'version': version}
+        results = await self.scan_packages_direct([package])
+        return VulnerabilityInfo(**results[0])
+
+    async def scan_packages_direct(self, packages: Iterable[dict]) -> List[dict]:
+        """Scan multiple packages by querying the OSV HTTP API directly.
+        
+        Results are plain dictionaries shaped like VulnerabilityInfo, so they can
+        be formatted or serialized without a pydantic round-trip.
+        
+        Args:
+            packages: Iterable of package dictionaries with keys: package_name, ecosystem, version
+            
+        Returns:
+            List of result dictionaries for each package
+        """
+        # Duplicate packages are scanned once and fanned back out afterwards
+        keys = [(pkg['package_name'], pkg['ecosystem'], pkg['version']) for pkg in packages]
+        result_map = {key: self._cache_get(key) for key in dict.fromkeys(keys)}
+        missing = [key for key, result in result_map.items() if result is None]
+        if missing:
+            result_map.update(await self._scan_batch_direct(missing))
+        return [result_map[key] for key in keys]
+
+    async def scan_packages_batch(self, packages: Iterable[dict]) -> List[VulnerabilityInfo]:
         """Scan multiple packages for vulnerabilities.
         
         Args:
-            packages: List of package dictionaries with keys: package_name, ecosystem, version
+            packages: Iterable of package dictionaries with keys: package_name, ecosystem, version
             
         Returns:
             List of VulnerabilityInfo with scan results for each package
         """
-        results = []
-        for pkg in packages:
-            result = await self.scan_package(
-                pkg['package_name'], 
-                pkg['ecosystem'], 
-                pkg['version']
-            )
-            results.append(result)
-        return results
+        # Scans are I/O bound, so run them concurrently but cap the number
+        # of in-flight requests to avoid overwhelming the MCP server
+        sem = asyncio.Semaphore(self.config.max_concurrency)
+
+        async def _bounded(key: Tuple[str, str, str]) -> VulnerabilityInfo:
+            async with sem:
+                return await self.scan_package(*key)
+
+        # Duplicate packages are scanned once and fanned back out afterwards
+        keys = [(pkg['package_name'], pkg['ecosystem'], pkg['version']) for pkg in packages]
+        unique = list(dict.fromkeys(keys))
+        scanned = await asyncio.gather(*(_bounded(key) for key in unique))
+        result_map = dict(zip(unique, scanned))
+        return [result_map[key] for key in keys]
+
+    async def scan_packages_batch_single(self, packages: Iterable[dict]) -> List[VulnerabilityInfo]:
+        """Scan multiple packages for vulnerabilities with batched agent runs.
+
+        Uses the OSV query_vulnerabilities_batch tool so that up to
+        _LLM_BATCH_SIZE packages are resolved in one conversation instead of
+        one conversation per package.
+
+        Args:
+            packages: Iterable of package dictionaries with keys: package_name, ecosystem, version
+
+        Returns:
+            List of VulnerabilityInfo with scan results for each package
+        """
+        if self.config.direct:
+            return [VulnerabilityInfo(**result) for result in await self.scan_packages_direct(packages)]
+
+        # Duplicate packages are scanned once and fanned back out afterwards
+        keys = [(pkg['package_name'], pkg['ecosystem'], pkg['version']) for pkg in packages]
+        result_map = {key: self._cache_get(key) for key in dict.fromkeys(keys)}
+        missing = [key for key, result in result_map.items() if result is None]
+        if missing:
+            sem = asyncio.Semaphore(self.config.max_concurrency)
+
+            async def _bounded(chunk: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], VulnerabilityInfo]:
+                async with sem:
+                    return await self._scan_batch_agent(chunk)
+
+            chunks = [missing[i:i + _LLM_BATCH_SIZE] for i in range(0, len(missing), _LLM_BATCH_SIZE)]
+            for scanned in await asyncio.gather(*(_bounded(chunk) for chunk in chunks)):
+                result_map.update(scanned)
+        return [result_map[key] for key in keys]
 
     async def get_vulnerability_details(self, vulnerability_id: str) -> str:
         """Get detailed information about a specific vulnerability.
@@ -146,11 +540,219 @@ Always provide the package name, ecosystem, version, vulnerability count, catego
         Returns:
             Detailed vulnerability information as string
         """
+        if self.agent is None:
+            return "Error retrieving vulnerability details: an Anthropic API key is required"
+
         query = f"Get detailed information about vulnerability {vulnerability_id}"
         
         try:
-            async with self.agent.run_mcp_servers():
-                result = await self.agent.run(query)
-                return result.output.summary
+            result = await self._run_agent(query)
+            return result.output.summary
         except Exception as e:
-            return f"Error retrieving vulnerability details: {str(e)}"
\ No newline at end of file
+            return f"Error retrieving vulnerability details: {str(e)}"
+
+    @_retry_transient
+    async def _run_agent(self, query: str, **kwargs):
+        """Run the LLM agent, retrying transient network failures."""
+        return await self.agent.run(query, **kwargs)
+
+    def _http_client(self) -> httpx.AsyncClient:
+        """Return the shared OSV HTTP client, creating it on first use."""
+        if self._http is None:
+            # HTTP/2 lets concurrent OSV requests multiplex over one connection
+            self._http = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+                timeout=httpx.Timeout(30.0, connect=5.0),
+            )
+        return self._http
+
+    @_retry_transient
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        """Call the OSV HTTP API, retrying transient network failures."""
+        response = await self._http_client().request(method, f"{self.config.osv_api_url}{path}", **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def _circuit_open(self) -> bool:
+        """Return whether scans are currently short-circuited after repeated failures."""
+        return time.monotonic() < self._circuit_open_until
+
+    def _circuit_error(self) -> RuntimeError:
+        """Build the error reported for scans skipped by the open circuit."""
+        return RuntimeError(
+            f"skipped after {self._consecutive_failures} consecutive scan failures; "
+            f"retrying in {self.config.circuit_reset_seconds:g}s"
+        )
+
+    def _record_success(self) -> None:
+        """Close the circuit after a successful scan."""
+        self._consecutive_failures = 0
+
+    def _record_failure(self) -> None:
+        """Count a failed scan, opening the circuit once the threshold is reached."""
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.config.failure_threshold:
+            self._circuit_open_until = time.monotonic() + self.config.circuit_reset_seconds
+
+    async def _query_osv(self, package_name: str, ecosystem: str, version: str) -> List[dict]:
+        """Return every OSV vulnerability record affecting a package version."""
+        payload = {"package": {"name": package_name, "ecosystem": ecosystem}, "version": version}
+        vulns = []
+        while True:
+            data = await self._request('POST', '/query', json=payload)
+            vulns.extend(data.get('vulns', []))
+            if not data.get('next_page_token'):
+                return vulns
+            payload['page_token'] = data['next_page_token']
+
+    async def _scan_batch_direct(self, keys: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], dict]:
+        """Scan packages with one OSV querybatch call plus a lookup per advisory."""
+        if self._circuit_open():
+            return {key: _error_dict(*key, self._circuit_error()) for key in keys}
+
+        if len(keys) == 1:
+            # A single query returns full records, saving the advisory lookups
+            key = keys[0]
+            try:
+                vulns = await self._query_osv(*key)
+            except Exception as e:
+                self._record_failure()
+                return {key: _error_dict(*key, e)}
+            self._record_success()
+            result = _build_result_dict(*key, vulns)
+            self._cache_put(key, result)
+            return {key: result}
+
+        # OSV caps the number of queries per querybatch request
+        chunks = [keys[i:i + _QUERYBATCH_LIMIT] for i in range(0, len(keys), _QUERYBATCH_LIMIT)]
+        batches = await asyncio.gather(*(self._querybatch(chunk) for chunk in chunks), return_exceptions=True)
+
+        results: Dict[Tuple[str, str, str], dict] = {}
+        listed: Dict[Tuple[str, str, str], List[str]] = {}
+        paged: List[Tuple[str, str, str]] = []
+        failures = 0
+        for chunk, batch in zip(chunks, batches):
+            if isinstance(batch, BaseException):
+                # A failed request only fails the packages it covered
+                failures += 1
+                results.update((key, _error_dict(*key, batch)) for key in chunk)
+                continue
+            for key, res in zip(chunk, batch):
+                if res.get('next_page_token'):
+                    paged.append(key)
+                else:
+                    listed[key] = [vuln['id'] for vuln in res.get('vulns', [])]
+
+        # querybatch only returns advisory IDs, so fetch each distinct advisory once
+        sem = asyncio.Semaphore(self.config.max_concurrency)
+
+        async def _fetch(vuln_id: str) -> dict:
+            async with sem:
+                return await self._request('GET', f'/vulns/{vuln_id}')
+
+        async def _paged(key: Tuple[str, str, str]) -> List[dict]:
+            async with sem:
+                return await self._query_osv(*key)
+
+        vuln_ids = list(dict.fromkeys(vuln_id for ids in listed.values() for vuln_id in ids))
+        details, paged_vulns = await asyncio.gather(
+            asyncio.gather(*(_fetch(vuln_id) for vuln_id in vuln_ids), return_exceptions=True),
+            # Packages with more results than one page are queried individually
+            asyncio.gather(*(_paged(key) for key in paged), return_exceptions=True),
+        )
+        records = dict(zip(vuln_ids, details))
+        vulns_by_key: Dict[Tuple[str, str, str], Union[List[dict], BaseException]] = dict(zip(paged, paged_vulns))
+        for key, ids in listed.items():
+            vulns = [records[vuln_id] for vuln_id in ids]
+            # A failed advisory lookup only fails the packages it affects
+            vulns_by_key[key] = next((v for v in vulns if isinstance(v, BaseException)), vulns)
+        failures += sum(isinstance(r, BaseException) for r in (*details, *paged_vulns))
+
+        for key in keys:
+            if key in results:
+                continue
+            vulns = vulns_by_key.get(key)
+            if vulns is None:
+                results[key] = _error_dict(*key, ValueError("no result returned by OSV"))
+            elif isinstance(vulns, BaseException):
+                results[key] = _error_dict(*key, vulns)
+            else:
+                result = _build_result_dict(*key, vulns)
+                self._cache_put(key, result)
+                results[key] = result
+
+        for _ in range(failures):
+            self._record_failure()
+        if not failures:
+            self._record_success()
+        return results
+
+    async def _scan_batch_agent(self, keys: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], VulnerabilityInfo]:
+        """Scan one chunk of packages with a single agent run."""
+        if self._circuit_open():
+            return {key: self._error_result(*key, self._circuit_error()) for key in keys}
+
+        queries = [
+            {"name": name, "ecosystem": ecosystem, "version": version}
+            for name, ecosystem, version in keys
+        ]
+        query = (
+            "Use query_vulnerabilities_batch to scan these packages for vulnerabilities: "
+            f"{json.dumps(queries)}. "
+            "Return one result per package, in the same order as given."
+        )
+
+        try:
+            result = await self._run_agent(query, output_type=BatchResult)
+            scanned = result.output.results
+        except Exception as e:
+            # Return a basic error response for every package in the chunk if MCP fails
+            self._record_failure()
+            return {key: self._error_result(*key, e) for key in keys}
+        self._record_success()
+
+        # Match on the package fields the agent reported rather than trusting
+        # it to keep the input order; unmatched packages become error results
+        matched: Dict[Tuple[str, str, str], VulnerabilityInfo] = {}
+        for info in scanned:
+            matched.setdefault((info.package_name, info.ecosystem, info.version), info)
+
+        results: Dict[Tuple[str, str, str], VulnerabilityInfo] = {}
+        for key in keys:
+            info = matched.get(key)
+            if info is None:
+                results[key] = self._error_result(*key, ValueError("no result returned by agent"))
+            else:
+                self._cache_put(key, info)
+                results[key] = info
+        return results
+
+    async def _querybatch(self, keys: List[Tuple[str, str, str]]) -> List[dict]:
+        """Return the OSV querybatch results for up to _QUERYBATCH_LIMIT packages."""
+        queries = [
+            {"package": {"name": name, "ecosystem": ecosystem}, "version": version}
+            for name, ecosystem, version in keys
+        ]
+        return (await self._request('POST', '/querybatch', json={"queries": queries})).get('results', [])
+
+    def _cache_get(self, key: Tuple[str, str, str]) -> Optional[Union[VulnerabilityInfo, dict]]:
+        """Return a cached scan result, marking it as most recently used."""
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+        return result
+
+    def _cache_put(self, key: Tuple[str, str, str], result: Union[VulnerabilityInfo, dict]) -> None:
+        """Store a scan result, evicting the least recently used entry when full."""
+        if self.config.cache_size <= 0:
+            return
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.config.cache_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _error_result(package_name: str, ecosystem: str, version: str, error: Exception) -> VulnerabilityInfo:
+        """Build a placeholder result for a package that could not be scanned."""
+        return VulnerabilityInfo(**_error_dict(package_name, ecosystem, version, error))
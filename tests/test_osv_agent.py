@@ -0,0 +1,91 @@
+import pytest
+
+from buildkite_demo_agent.osv_agent import (
+    _build_result_dict,
+    _cvss3_base_score,
+    _group_aliases,
+    _severity_bucket,
+)
+
+
+def _vuln(vuln_id, aliases=(), severity=None, cvss=None, fixed=None, name='requests'):
+    """Build a minimal OSV record."""
+    vuln = {'id': vuln_id, 'aliases': list(aliases)}
+    if severity:
+        vuln['database_specific'] = {'severity': severity}
+    if cvss:
+        vuln['severity'] = [{'type': 'CVSS_V3', 'score': cvss}]
+    if fixed:
+        vuln['affected'] = [{
+            'package': {'name': name, 'ecosystem': 'PyPI'},
+            'ranges': [{'type': 'ECOSYSTEM', 'events': fixed}],
+        }]
+    return vuln
+
+
+@pytest.mark.parametrize('vector, score', [
+    ('CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H', 9.8),
+    ('CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:C/C:H/I:H/A:H', 10.0),
+    ('CVSS:3.0/AV:N/AC:L/PR:L/UI:N/S:C/C:L/I:L/A:N', 6.4),
+    ('CVSS:3.1/AV:N/AC:H/PR:N/UI:R/S:U/C:L/I:N/A:N', 3.1),
+    ('CVSS:3.1/AV:L/AC:H/PR:H/UI:R/S:U/C:L/I:N/A:N', 1.8),
+    ('CVSS:3.1/AV:L/AC:L/PR:H/UI:N/S:U/C:N/I:N/A:N', 0.0),
+])
+def test_cvss3_base_score(vector, score):
+    assert _cvss3_base_score(vector) == score
+
+
+@pytest.mark.parametrize('vector', ['', 'garbage', 'CVSS:3.1/AV:N', 'CVSS:3.1/AV:X/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H'])
+def test_cvss3_base_score_rejects_malformed_vectors(vector):
+    assert _cvss3_base_score(vector) is None
+
+
+def test_severity_bucket_prefers_database_rating_over_cvss():
+    vuln = _vuln('GHSA-1', severity='MODERATE', cvss='CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H')
+    assert _severity_bucket(vuln) == 'medium'
+
+
+def test_severity_bucket_falls_back_to_cvss():
+    assert _severity_bucket(_vuln('PYSEC-1', cvss='CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H')) == 'critical'
+    assert _severity_bucket(_vuln('PYSEC-2', cvss='CVSS:3.1/AV:N/AC:H/PR:N/UI:R/S:U/C:L/I:N/A:N')) == 'low'
+    assert _severity_bucket(_vuln('PYSEC-3')) is None
+
+
+def test_group_aliases_links_records_through_shared_aliases():
+    vulns = [
+        _vuln('PYSEC-1', aliases=['CVE-1']),
+        _vuln('GHSA-2'),
+        _vuln('GHSA-1', aliases=['CVE-1']),
+        _vuln('OSV-1', aliases=['PYSEC-1']),
+    ]
+    groups = _group_aliases(vulns)
+    assert [[vuln['id'] for vuln in group] for group in groups] == [['PYSEC-1', 'GHSA-1', 'OSV-1'], ['GHSA-2']]
+
+
+def test_build_result_dict_collapses_aliases_to_rated_advisory():
+    vulns = [
+        _vuln('PYSEC-1', aliases=['CVE-1', 'GHSA-1']),
+        _vuln('GHSA-1', aliases=['CVE-1'], severity='HIGH'),
+    ]
+    result = _build_result_dict('requests', 'PyPI', '2.25.0', vulns)
+    assert result['vulnerabilities_found'] == 1
+    assert result['high_vulnerabilities'] == ['GHSA-1']
+    assert result['medium_vulnerabilities'] == []
+    assert result['summary'] == "1 known vulnerability affects requests@2.25.0"
+
+
+def test_build_result_dict_reports_unrated_advisories_as_medium():
+    result = _build_result_dict('requests', 'PyPI', '2.25.0', [_vuln('PYSEC-1')])
+    assert result['medium_vulnerabilities'] == ['PYSEC-1']
+    assert result['scan_failed'] is False
+
+
+def test_build_result_dict_recommends_fixes_for_the_scanned_range():
+    events = [{'introduced': '0'}, {'fixed': '1.2.5'}, {'introduced': '2.0'}, {'fixed': '2.31.0'}]
+    vulns = [_vuln('GHSA-1', severity='HIGH', fixed=events, name='Django')]
+    assert _build_result_dict('django', 'PyPI', '2.25.0', vulns)['recommendations'] == [
+        'GHSA-1: upgrade to 2.31.0'
+    ]
+    assert _build_result_dict('django', 'PyPI', '1.0', vulns)['recommendations'] == [
+        'GHSA-1: upgrade to 1.2.5'
+    ]